@@ -1,9 +1,136 @@
 import math
+from collections import namedtuple
 from datetime import date
+from functools import partial
 
+import numpy as np
 import streamlit as st
 
 
+# ----------------- Domain layout ----------------- #
+
+# Indices feeding each domain score (an index may count toward several).
+DOMAIN_MAP = {
+    "Inflammation": ("NLR", "PLR", "SII", "SIRI"),
+    "Oxidative / Hb-MCV": ("AIP", "RDW", "RDW/Hb", "RLR"),
+    "Endothelial": ("AIP", "METS-IR", "NHR", "MHR", "Non-HDL"),
+    "Metabolic / Liver / IR": ("TyG", "METS-IR", "HSI", "FIB-4", "eGDR", "RPR", "PNI"),
+}
+
+# Flattened (SoA) layout: all domain members in one contiguous run, with the
+# start offset and length of each domain segment for np.add.reduceat.
+_DOMAIN_KEYS = tuple(k for keys in DOMAIN_MAP.values() for k in keys)
+_DOMAIN_SIZES = np.array([len(keys) for keys in DOMAIN_MAP.values()])
+_DOMAIN_OFFSETS = np.concatenate(([0], np.cumsum(_DOMAIN_SIZES)[:-1]))
+
+# Severity points -> 0-25 domain score: round(25 * points / (3 * size), 1).
+# Points are small integers (0..3 per member), so every reachable score is
+# tabulated once per domain and scoring is a single lookup.
+_SCORE_SCALE = 25.0 / 3.0
+_DOMAIN_ROWS = np.arange(len(DOMAIN_MAP))
+_DOMAIN_SCORES = np.round(np.arange(3 * _DOMAIN_SIZES.max() + 1) * (_SCORE_SCALE / _DOMAIN_SIZES)[:, None], 1)
+
+# Display order of the key indices, shared by the screen and the PDF report
+KEY_ORDER = (
+    "NLR", "PLR", "SII", "SIRI",
+    "TyG", "METS-IR", "AIP",
+    "HSI", "FIB-4", "eGDR",
+    "RDW", "RDW/Hb", "Hb/MCV",
+    "RLR", "NHR", "MHR",
+    "RPR", "Non-HDL", "PNI",
+)
+
+# Domain score (0-25) bands: <6 Normal, <12 Mild, <18 Moderate, else Severe
+_DOMAIN_CUTS = np.array([6, 12, 18])
+_DOMAIN_LABELS = np.array(["Normal", "Mild", "Moderate", "Severe"])
+
+# Total score (0-100) risk bands: <20, <40, <70, else High
+_RISK_CUTS = np.array([20, 40, 70])
+_RISK_LABELS = np.array(["Very low risk", "Mild risk", "Moderate risk", "High risk"])
+
+
+# ----------------- Severity cut-bands ----------------- #
+
+_HIGH_LABELS = ("Normal", "Mild high", "Moderate high")
+_LOW_LABELS = ("Severe low", "Moderate low", "Mild low", "Normal")
+
+# Higher is worse: (upper_limits, labels). value <= upper_limits[i] gives
+# labels[i]; values above the last limit take the last label.
+SEVERITY_CUTOFFS = {
+    "NLR": ((2.0, 3.0, 5.0), _HIGH_LABELS),
+    "PLR": ((150, 200, 300), _HIGH_LABELS),
+    "SII": ((500, 800, 1200), _HIGH_LABELS),
+    "SIRI": ((1.0, 1.5, 3.0), _HIGH_LABELS),
+    # AIP (updated cut-bands): <0.11, 0.11-<0.15, 0.15-<0.24, >=0.24
+    "AIP": ((0.11, 0.15, 0.24, 1.0), ("Low risk", "Borderline", "Intermediate", "High")),
+    "TyG": ((8.5, 9.0, 9.5), _HIGH_LABELS),
+    "METS-IR": ((40, 50, 60), _HIGH_LABELS),
+    # HSI (updated cut-bands): <30, 30-<36, >=36
+    "HSI": ((30, 36, 100), ("Low", "Borderline", "High")),
+    "FIB-4": ((1.3, 2.67), ("Low", "Indeterminate")),
+    "RDW": ((13.0, 14.5, 16.0), _HIGH_LABELS),
+    "RDW/Hb": ((1.0, 1.4, 1.8), _HIGH_LABELS),
+    "RLR": ((6.0, 8.0, 12.0), _HIGH_LABELS),
+    "NHR": ((0.08, 0.12, 0.18), _HIGH_LABELS),
+    "MHR": ((0.010, 0.015, 0.022), _HIGH_LABELS),
+    "RPR": ((0.04, 0.06, 0.08), _HIGH_LABELS),
+    "Non-HDL": ((130, 159, 189), _HIGH_LABELS),
+}
+
+# Higher is better: (lower_limits, labels). value < lower_limits[i] gives
+# labels[i]; values at or above the last limit take the last label.
+LOW_SEVERITY_CUTOFFS = {
+    "eGDR": ((4.0, 6.0, 8.0), _LOW_LABELS),
+    "PNI": ((35, 40, 45), _LOW_LABELS),
+}
+
+# Hb/MCV is descriptive only: <1.3, 1.3-1.7, >1.7
+_HB_MCV_LABELS = (
+    "Low Hb/MCV index (TT-like pattern)",
+    "Intermediate Hb/MCV index",
+    "High Hb/MCV index (IDA-like pattern)",
+)
+
+# Severity label -> numeric penalty for domain scores (max 3 per index)
+SEVERITY_POINTS = {
+    "NA": 0,
+    # Good / low-risk labels
+    "Normal": 0, "Low": 0, "Low risk": 0,
+    # Mild / Borderline
+    "Mild high": 1, "Mild low": 1, "Borderline": 1,
+    # Moderate, Intermediate, Indeterminate
+    "Moderate high": 2, "Moderate low": 2, "Intermediate": 2, "Indeterminate": 2,
+    # High / Severe
+    "High": 3, "Severe low": 3,
+}
+
+# Both tables packed into one (K, 4) limit matrix in "value <= limit" form so
+# every index is banded by a single array comparison. Higher-is-better rows
+# are stored negated (value and limits) with their labels reversed; short rows
+# are padded with +inf.
+_SEV_KEYS = tuple(SEVERITY_CUTOFFS) + tuple(LOW_SEVERITY_CUTOFFS)
+_SEV_SIGNS = np.array([1.0] * len(SEVERITY_CUTOFFS) + [-1.0] * len(LOW_SEVERITY_CUTOFFS))
+_SEV_LABELS = tuple(labels for _, labels in SEVERITY_CUTOFFS.values()) + tuple(
+    labels[::-1] for _, labels in LOW_SEVERITY_CUTOFFS.values()
+)
+_SEV_MAX_LEVELS = np.array([len(labels) - 1 for labels in _SEV_LABELS])
+_SEV_LIMITS = np.full((len(_SEV_KEYS), 4), np.inf)
+for _row, (_limits, _) in enumerate(SEVERITY_CUTOFFS.values()):
+    _SEV_LIMITS[_row, :len(_limits)] = _limits
+for _row, (_limits, _) in enumerate(LOW_SEVERITY_CUTOFFS.values(), start=len(SEVERITY_CUTOFFS)):
+    _SEV_LIMITS[_row, :len(_limits)] = [-limit for limit in reversed(_limits)]
+
+# Domain points per band position; the last column (level -1) is a missing value
+_SEV_POINTS = np.zeros((len(_SEV_KEYS), 5), dtype=int)
+for _row, _labels in enumerate(_SEV_LABELS):
+    _SEV_POINTS[_row, :len(_labels)] = [SEVERITY_POINTS[label] for label in _labels]
+
+_SEV_ROWS = np.arange(len(_SEV_KEYS))
+
+# Column of each domain member (in _DOMAIN_KEYS order) within _SEV_KEYS
+_DOMAIN_SEV_COLS = np.array([_SEV_KEYS.index(key) for key in _DOMAIN_KEYS])
+
+
 # ----------------- Utility functions ----------------- #
 
 def safe_float(x, default=None):
@@ -13,47 +140,94 @@ def safe_float(x, default=None):
         return default
 
 
-def classify_index(value, cutoffs):
+def severity_levels(values):
     """
-    cutoffs: list of (upper_limit, label) in ascending order.
-    Returns label for the first upper_limit where value <= limit,
-    else the label of the last cutoff.
+    values: float array (..., K) of index values in _SEV_KEYS order, NaN if missing.
+    Returns the band position of each value into _SEV_LABELS, -1 where missing.
     """
-    if value is None:
-        return "NA"
-    for limit, label in cutoffs:
-        if value <= limit:
-            return label
-    return cutoffs[-1][1]
+    levels = ((_SEV_SIGNS * values)[..., None] > _SEV_LIMITS).sum(axis=-1)
+    levels = np.minimum(levels, _SEV_MAX_LEVELS)
+    return np.where(np.isnan(values), -1, levels)
+
+
+def hb_mcv_level(ratio):
+    """Position in _HB_MCV_LABELS as a sum of comparisons; scalar or array."""
+    return np.add(ratio >= 1.3, ratio > 1.7, dtype=int)
+
+
+def domain_label(score):
+    """Label for a 0-25 domain score, or an array of labels for an array of scores."""
+    return _DOMAIN_LABELS[np.searchsorted(_DOMAIN_CUTS, score, side="right")]
 
 
 def risk_from_total(total_score):
+    """Risk category for a 0-100 total score, or an array of them for an array."""
     if total_score is None:
         return "NA"
-    if total_score < 20:
-        return "Very low risk"
-    elif total_score < 40:
-        return "Mild risk"
-    elif total_score < 70:
-        return "Moderate risk"
-    else:
-        return "High risk"
+    return _RISK_LABELS[np.searchsorted(_RISK_CUTS, total_score, side="right")]
+
+
+def format_index_value(val):
+    if val is None:
+        return "NA"
+    if isinstance(val, (int, float)) and abs(val) >= 100:
+        return f"{val:.1f}"
+    if isinstance(val, (int, float)):
+        return f"{val:.2f}"
+    return str(val)
+
+
+def index_rows(indices, idx_sev):
+    """(key, formatted value, severity label) per key index in KEY_ORDER; shared by the screen and the PDF."""
+    return [(key, format_index_value(indices.get(key)), idx_sev.get(key, "NA")) for key in KEY_ORDER]
+
+
+def domain_rows(domain_scores, domain_labels):
+    """(domain, formatted 0-25 score, label) per domain in DOMAIN_MAP order; shared by the screen and the PDF."""
+    return [(dom, f"{domain_scores.get(dom, 0.0):.1f}", domain_labels.get(dom, "NA")) for dom in DOMAIN_MAP]
+
+
+# Punctuation outside latin-1 that has a plain ASCII stand-in
+_LATIN1_TABLE = str.maketrans(
+    {
+        "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+        "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"',
+        "\u2026": "...", "\u2022": "*",
+        "\u2264": "<=", "\u2265": ">=",
+    }
+)
 
 
 def to_latin1(text):
     """
     Ensure text is safe for FPDF core fonts.
-    Non-latin-1 characters are stripped.
+    Dashes, smart quotes, ellipses, bullets and <=/>= become ASCII;
+    other non-latin-1 characters are stripped.
     """
     if text is None:
         return ""
     if not isinstance(text, str):
         text = str(text)
-    return text.encode("latin-1", "ignore").decode("latin-1")
+    if text.isascii():
+        return text
+    return text.translate(_LATIN1_TABLE).encode("latin-1", "ignore").decode("latin-1")
 
 
 # ----------------- Core calculations ----------------- #
 
+_LN2 = math.log(2)
+
+# AIP unit conversion (TG / 88.57, HDL-C / 38.67 mg/dL -> mmol/L) as one log10 offset
+_AIP_OFFSET = math.log10(38.67 / 88.57)
+
+# Result of calculate_indices; unpacks like the plain 6-tuple it replaces.
+IndexReport = namedtuple(
+    "IndexReport",
+    ["indices", "idx_sev", "domain_scores", "domain_labels", "total_score", "risk_cat"],
+)
+
+
+@st.cache_data(show_spinner=False)
 def calculate_indices(inputs):
     age = safe_float(inputs.get("age"))
     sex = inputs.get("sex", "M")
@@ -100,62 +274,51 @@ def calculate_indices(inputs):
         if mono_pct is not None:
             amc = wbc * mono_pct / 100.0
 
-    # ----- Inflammatory indices ----- #
-
-    nlr = None
-    if anc is not None and alc is not None and alc != 0:
-        nlr = anc / alc
-
-    plr = None
-    if platelets is not None and alc is not None and alc != 0:
-        plr = platelets / alc
-
-    sii = None
-    if platelets is not None and anc is not None and alc is not None and alc != 0:
-        # SII using absolute values: (Platelets x ANC) / ALC
-        sii = (platelets * anc) / alc
-
-    siri = None
-    if anc is not None and amc is not None and alc is not None and alc != 0:
-        # SIRI = (ANC x AMC) / ALC using absolute counts
-        siri = (anc * amc) / alc
+    # ----- Inflammatory indices (all over ALC: one shared guard) ----- #
+
+    nlr = plr = sii = siri = None
+    if alc:
+        if anc is not None:
+            nlr = anc / alc
+            if amc is not None:
+                # SIRI = (ANC x AMC) / ALC using absolute counts
+                siri = (anc * amc) / alc
+        if platelets is not None:
+            plr = platelets / alc
+            if anc is not None:
+                # SII using absolute values: (Platelets x ANC) / ALC
+                sii = (platelets * anc) / alc
 
     # ----- Atherogenic / metabolic indices ----- #
 
-    # AIP: log10(TG(mmol/L) / HDL(mmol/L))
+    # ln(HDL) for METS-IR
+    ln_hdl = math.log(hdl) if hdl and hdl > 0 else None
+
+    # AIP: log10(TG(mmol/L) / HDL(mmol/L)) = log10(TG / HDL) in mg/dL + offset
     aip = None
     if tg and hdl and hdl > 0:
-        tg_mmol = tg / 88.57
-        hdl_mmol = hdl / 38.67
-        if hdl_mmol > 0:
-            aip = math.log10(tg_mmol / hdl_mmol)
+        aip = math.log10(tg / hdl) + _AIP_OFFSET
 
     # TyG: ln [ TG (mg/dL) * FPG (mg/dL) / 2 ]
     tyg = None
     if tg and fasting_glu:
-        tyg = math.log(tg * fasting_glu / 2.0)
+        tyg = math.log(tg * fasting_glu) - _LN2
 
-    # METS-IR: ln(2*FPG + TG) * BMI / ln(HDL)
+    # METS-IR: ln(2*FPG + TG) * BMI / ln(HDL); undefined at HDL = 1 (ln = 0)
     mets_ir = None
-    if fasting_glu and tg and bmi and hdl and hdl > 0:
-        try:
-            mets_ir = math.log(2 * fasting_glu + tg) * bmi / math.log(hdl)
-        except ValueError:
-            mets_ir = None
+    if fasting_glu and tg and bmi and ln_hdl:
+        mets_ir = math.log(2 * fasting_glu + tg) * bmi / ln_hdl
 
     # Non-HDL: optional (requires Total Cholesterol)
     non_hdl = None
     if total_chol is not None and hdl is not None:
         non_hdl = total_chol - hdl
 
-    # Hepatic Steatosis Index
+    # Hepatic Steatosis Index (+2 female, +2 diabetes, folded into one add)
     hsi = None
-    if alt and ast and ast != 0 and bmi:
-        hsi = 8 * (alt / ast) + bmi
-        if sex.upper() == "F":
-            hsi += 2
-        if diabetes_flag:
-            hsi += 2
+    if alt and ast and bmi:
+        hsi_bonus = (2 if sex.upper() == "F" else 0) + (2 if diabetes_flag else 0)
+        hsi = 8 * (alt / ast) + bmi + hsi_bonus
 
     # FIB-4
     fib4 = None
@@ -171,35 +334,23 @@ def calculate_indices(inputs):
 
     rdw_index = rdw
 
-    rdw_hb = None
-    if rdw is not None and hb and hb != 0:
-        rdw_hb = rdw / hb
+    rdw_hb = rdw / hb if rdw is not None and hb else None
 
-    hb_mcv_ratio = None
-    if hb is not None and mcv and mcv != 0:
-        hb_mcv_ratio = hb / mcv
+    hb_mcv_ratio = hb / mcv if hb is not None and mcv else None
 
     # ----- New indices ----- #
 
     # RLR = RDW / ALC
-    rlr = None
-    if rdw is not None and alc is not None and alc != 0:
-        rlr = rdw / alc
+    rlr = rdw / alc if rdw is not None and alc else None
 
     # NHR = ANC / HDL
-    nhr = None
-    if anc is not None and hdl and hdl != 0:
-        nhr = anc / hdl
+    nhr = anc / hdl if anc is not None and hdl else None
 
     # MHR = AMC / HDL
-    mhr = None
-    if amc is not None and hdl and hdl != 0:
-        mhr = amc / hdl
+    mhr = amc / hdl if amc is not None and hdl else None
 
     # RPR = RDW / Platelets
-    rpr = None
-    if rdw is not None and platelets and platelets != 0:
-        rpr = rdw / platelets
+    rpr = rdw / platelets if rdw is not None and platelets else None
 
     # PNI = 10 * albumin + 5 * ALC
     pni = None
@@ -230,269 +381,238 @@ def calculate_indices(inputs):
 
     # ----- Severity labels per index (cut-bands) ----- #
 
-    idx_sev = {}
+    values = np.array([indices[key] for key in _SEV_KEYS], dtype=float)  # None -> NaN
+    levels = severity_levels(values)
+    idx_sev = {
+        key: labels[level] if level >= 0 else "NA"
+        for key, labels, level in zip(_SEV_KEYS, _SEV_LABELS, levels.tolist())
+    }
 
-    # NLR
-    idx_sev["NLR"] = classify_index(
-        nlr,
-        [
-            (2.0, "Normal"),
-            (3.0, "Mild high"),
-            (5.0, "Moderate high"),
-        ],
-    )
+    # Hb/MCV (descriptive only)
+    idx_sev["Hb/MCV"] = "NA" if hb_mcv_ratio is None else _HB_MCV_LABELS[hb_mcv_level(hb_mcv_ratio)]
 
-    # PLR
-    idx_sev["PLR"] = classify_index(
-        plr,
-        [
-            (150, "Normal"),
-            (200, "Mild high"),
-            (300, "Moderate high"),
-        ],
-    )
+    # Domain scores: points straight from the band levels, one segmented sum
+    points = _SEV_POINTS[_SEV_ROWS, levels]
+    raw = np.add.reduceat(points[_DOMAIN_SEV_COLS], _DOMAIN_OFFSETS)
+    scores_0_25 = _DOMAIN_SCORES[_DOMAIN_ROWS, raw]
 
-    # SII
-    idx_sev["SII"] = classify_index(
-        sii,
-        [
-            (500, "Normal"),
-            (800, "Mild high"),
-            (1200, "Moderate high"),
-        ],
-    )
+    domain_scores = dict(zip(DOMAIN_MAP, scores_0_25.tolist()))
+    domain_labels = dict(zip(DOMAIN_MAP, domain_label(scores_0_25).tolist()))
 
-    # SIRI
-    idx_sev["SIRI"] = classify_index(
-        siri,
-        [
-            (1.0, "Normal"),
-            (1.5, "Mild high"),
-            (3.0, "Moderate high"),
-        ],
-    )
+    total_score = sum(domain_scores.values())
+    risk_cat = str(risk_from_total(total_score))
 
-    # AIP (updated cut-bands)
-    idx_sev["AIP"] = classify_index(
-        aip,
-        [
-            (0.11, "Low risk"),      # <0.11
-            (0.15, "Borderline"),    # 0.11–<0.15
-            (0.24, "Intermediate"),  # 0.15–<0.24
-            (1.0, "High"),           # >=0.24
-        ],
-    )
+    return IndexReport(indices, idx_sev, domain_scores, domain_labels, total_score, risk_cat)
 
-    # TyG
-    idx_sev["TyG"] = classify_index(
-        tyg,
-        [
-            (8.5, "Normal"),
-            (9.0, "Mild high"),
-            (9.5, "Moderate high"),
-        ],
-    )
 
-    # METS-IR
-    idx_sev["METS-IR"] = classify_index(
-        mets_ir,
-        [
-            (40, "Normal"),
-            (50, "Mild high"),
-            (60, "Moderate high"),
-        ],
-    )
+# ----------------- Batch (cohort) calculations ----------------- #
 
-    # HSI (updated cut-bands)
-    idx_sev["HSI"] = classify_index(
-        hsi,
-        [
-            (30, "Low"),         # <30
-            (36, "Borderline"),  # 30–<36
-            (100, "High"),       # >=36
-        ],
-    )
+def _batch_column(columns, key, n):
+    col = columns.get(key)
+    if col is None:
+        return np.full(n, np.nan)
+    return np.asarray(col, dtype=float)
 
-    # FIB-4
-    idx_sev["FIB-4"] = classify_index(
-        fib4,
-        [
-            (1.3, "Low"),
-            (2.67, "Indeterminate"),
-        ],
-    )
 
-    # eGDR (higher is better)
-    if egdr is None:
-        idx_sev["eGDR"] = "NA"
-    else:
-        if egdr < 4.0:
-            idx_sev["eGDR"] = "Severe low"
-        elif egdr < 6.0:
-            idx_sev["eGDR"] = "Moderate low"
-        elif egdr < 8.0:
-            idx_sev["eGDR"] = "Mild low"
-        else:
-            idx_sev["eGDR"] = "Normal"
-
-    # RDW
-    idx_sev["RDW"] = classify_index(
-        rdw_index,
-        [
-            (13.0, "Normal"),
-            (14.5, "Mild high"),
-            (16.0, "Moderate high"),
-        ],
-    )
+def _batch_flag(columns, key, n):
+    col = columns.get(key)
+    if col is None:
+        return np.zeros(n, dtype=bool)
+    return np.nan_to_num(np.asarray(col, dtype=float)) != 0
 
-    # RDW/Hb
-    idx_sev["RDW/Hb"] = classify_index(
-        rdw_hb,
-        [
-            (1.0, "Normal"),
-            (1.4, "Mild high"),
-            (1.8, "Moderate high"),
-        ],
-    )
 
-    # Hb/MCV (descriptive only)
-    if hb_mcv_ratio is None:
-        idx_sev["Hb/MCV"] = "NA"
-    else:
-        if hb_mcv_ratio < 1.3:
-            idx_sev["Hb/MCV"] = "Low Hb/MCV index (TT-like pattern)"
-        elif hb_mcv_ratio <= 1.7:
-            idx_sev["Hb/MCV"] = "Intermediate Hb/MCV index"
-        else:
-            idx_sev["Hb/MCV"] = "High Hb/MCV index (IDA-like pattern)"
-
-    # RLR
-    idx_sev["RLR"] = classify_index(
-        rlr,
-        [
-            (6.0, "Normal"),
-            (8.0, "Mild high"),
-            (12.0, "Moderate high"),
-        ],
-    )
+def _batch_divide(a, b):
+    """a / b, NaN where b == 0 (the divide is skipped there, not masked after)."""
+    return np.divide(a, b, out=np.full(np.shape(b), np.nan), where=b != 0)
 
-    # NHR
-    idx_sev["NHR"] = classify_index(
-        nhr,
-        [
-            (0.08, "Normal"),
-            (0.12, "Mild high"),
-            (0.18, "Moderate high"),
-        ],
-    )
 
-    # MHR
-    idx_sev["MHR"] = classify_index(
-        mhr,
-        [
-            (0.010, "Normal"),
-            (0.015, "Mild high"),
-            (0.022, "Moderate high"),
-        ],
-    )
+def batch_index_values(columns):
+    """
+    Vectorized counterpart of the index formulas in calculate_indices.
 
-    # RPR
-    idx_sev["RPR"] = classify_index(
-        rpr,
-        [
-            (0.04, "Normal"),
-            (0.06, "Mild high"),
-            (0.08, "Moderate high"),
-        ],
-    )
+    columns: mapping of the calculate_indices input keys to equal-length
+    arrays (one entry per patient); absent columns count as missing.
+    Returns {index name: float array}, NaN where calculate_indices gives None.
+    """
+    n = len(columns[next(iter(columns))])
+
+    def col(key):
+        return _batch_column(columns, key, n)
+
+    age = col("age")
+    wbc, neut_pct, lymph_pct, mono_pct = col("wbc"), col("neut_pct"), col("lymph_pct"), col("mono_pct")
+    platelets, hb, mcv, rdw = col("platelets"), col("hb"), col("mcv"), col("rdw")
+    fasting_glu, tg, hdl, total_chol = col("fasting_glu"), col("tg"), col("hdl"), col("total_chol")
+    ast, alt, hba1c, albumin = col("ast"), col("alt"), col("hba1c"), col("albumin")
+    weight, height, waist = col("weight"), col("height"), col("waist")
+
+    sex = columns.get("sex")
+    female = np.zeros(n, dtype=bool) if sex is None else np.char.upper(np.asarray(sex, dtype=str)) == "F"
+    diabetes_flag = _batch_flag(columns, "diabetes", n)
+    htn = _batch_flag(columns, "htn", n)
+
+    # NaN propagates through the arithmetic, so only the zero / sign guards of
+    # the scalar path need an explicit mask.
+    nan = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bmi = np.where((weight != 0) & (height != 0), weight / ((height / 100.0) ** 2), nan)
+
+        anc = wbc * neut_pct / 100.0
+        alc = wbc * lymph_pct / 100.0
+        amc = wbc * mono_pct / 100.0
+
+        ln_hdl = np.where(hdl > 0, np.log(hdl), nan)
+
+        indices = {
+            "NLR": _batch_divide(anc, alc),
+            "PLR": _batch_divide(platelets, alc),
+            "SII": _batch_divide(platelets * anc, alc),
+            "SIRI": _batch_divide(anc * amc, alc),
+            "AIP": np.where((tg != 0) & (hdl > 0), np.log10(tg / hdl) + _AIP_OFFSET, nan),
+            "TyG": np.where((tg != 0) & (fasting_glu != 0), np.log(tg * fasting_glu) - _LN2, nan),
+            "METS-IR": np.where(
+                (fasting_glu != 0) & (tg != 0) & (bmi != 0) & (ln_hdl != 0),
+                np.log(2 * fasting_glu + tg) * bmi / ln_hdl,
+                nan,
+            ),
+            "HSI": np.where(
+                (alt != 0) & (ast != 0) & (bmi != 0),
+                8 * (alt / ast) + bmi + (2.0 * female + 2.0 * diabetes_flag),
+                nan,
+            ),
+            "FIB-4": np.where(
+                (age != 0) & (ast != 0) & (alt > 0) & (platelets > 0),
+                (age * ast) / (platelets * np.sqrt(alt)),
+                nan,
+            ),
+            "eGDR": np.where(waist != 0, 21.16 - (0.09 * waist) - (3.41 * htn) - (0.55 * hba1c), nan),
+            "RDW": rdw,
+            "RDW/Hb": _batch_divide(rdw, hb),
+            "Hb/MCV": _batch_divide(hb, mcv),
+            "RLR": _batch_divide(rdw, alc),
+            "NHR": _batch_divide(anc, hdl),
+            "MHR": _batch_divide(amc, hdl),
+            "RPR": _batch_divide(rdw, platelets),
+            "Non-HDL": total_chol - hdl,
+            "PNI": 10 * albumin + 5 * alc,
+        }
 
-    # Non-HDL
-    idx_sev["Non-HDL"] = classify_index(
-        non_hdl,
-        [
-            (130, "Normal"),
-            (159, "Mild high"),
-            (189, "Moderate high"),
-        ],
-    )
+    return indices
 
-    # PNI (higher is better)
-    if pni is None:
-        idx_sev["PNI"] = "NA"
-    else:
-        if pni < 35:
-            idx_sev["PNI"] = "Severe low"
-        elif pni < 40:
-            idx_sev["PNI"] = "Moderate low"
-        elif pni < 45:
-            idx_sev["PNI"] = "Mild low"
-        else:
-            idx_sev["PNI"] = "Normal"
-
-    # ---- Map severity -> numeric penalty for domain scores ---- #
-
-    def sev_to_score(label):
-        if label in ("NA", None):
-            return 0
-        # Good / low-risk labels
-        if label in ("Normal", "Low", "Low risk"):
-            return 0
-        # Mild / Borderline
-        if "Mild" in label or "Borderline" in label:
-            return 1
-        # Moderate, Intermediate, Indeterminate
-        if "Moderate" in label or "Intermediate" in label or "Indeterminate" in label:
-            return 2
-        # High / Severe
-        if "High" in label or "Severe" in label:
-            return 3
-        return 0
-
-    # Domains
-    dom_map = {
-        "Inflammation": ["NLR", "PLR", "SII", "SIRI"],
-        "Oxidative / Hb-MCV": ["AIP", "RDW", "RDW/Hb", "RLR"],
-        "Endothelial": ["AIP", "METS-IR", "NHR", "MHR", "Non-HDL"],
-        "Metabolic / Liver / IR": ["TyG", "METS-IR", "HSI", "FIB-4", "eGDR", "RPR", "PNI"],
+
+def calculate_indices_batch(columns):
+    """
+    Score a whole cohort at once: the vectorized counterpart of calculate_indices.
+
+    columns: as for batch_index_values. Returns an IndexReport whose fields hold
+    one entry per patient: float arrays for the indices, domain scores and
+    total score, string arrays for the severity, domain and risk labels.
+    """
+    indices = batch_index_values(columns)
+
+    # Severity labels: one (N, K) banding pass, then a table lookup per index
+    levels = severity_levels(np.column_stack([indices[key] for key in _SEV_KEYS]))
+    idx_sev = {
+        key: np.array(labels + ("NA",))[levels[:, col]]
+        for col, (key, labels) in enumerate(zip(_SEV_KEYS, _SEV_LABELS))
     }
+    hb_mcv_ratio = indices["Hb/MCV"]
+    idx_sev["Hb/MCV"] = np.where(
+        np.isnan(hb_mcv_ratio), "NA", np.array(_HB_MCV_LABELS)[hb_mcv_level(hb_mcv_ratio)]
+    )
 
-    domain_scores = {}
-    domain_labels = {}
-
-    for dom, keys in dom_map.items():
-        vals = [sev_to_score(idx_sev.get(k)) for k in keys if k in idx_sev]
-        if not vals:
-            domain_scores[dom] = 0.0
-            domain_labels[dom] = "NA"
-            continue
-
-        raw = sum(vals)
-        max_raw = len(vals) * 3  # max severity 3 per index
-        score_0_25 = round((raw / max_raw) * 25, 1)
-        domain_scores[dom] = score_0_25
-
-        if score_0_25 < 6:
-            lab = "Normal"
-        elif score_0_25 < 12:
-            lab = "Mild"
-        elif score_0_25 < 18:
-            lab = "Moderate"
-        else:
-            lab = "Severe"
-        domain_labels[dom] = lab
+    # Domain scores: (N, K) points, segmented sum along each row
+    points = _SEV_POINTS[_SEV_ROWS, levels]
+    raw = np.add.reduceat(points[:, _DOMAIN_SEV_COLS], _DOMAIN_OFFSETS, axis=1)
+    scores_0_25 = _DOMAIN_SCORES[_DOMAIN_ROWS, raw]
+    labels_0_25 = domain_label(scores_0_25)
+    domain_scores = {dom: scores_0_25[:, col] for col, dom in enumerate(DOMAIN_MAP)}
+    domain_labels = {dom: labels_0_25[:, col] for col, dom in enumerate(DOMAIN_MAP)}
 
-    total_score = sum(domain_scores.values())
+    total_score = scores_0_25.sum(axis=1)
     risk_cat = risk_from_total(total_score)
 
-    return indices, idx_sev, domain_scores, domain_labels, total_score, risk_cat
+    return IndexReport(indices, idx_sev, domain_scores, domain_labels, total_score, risk_cat)
+
+
+def score_cohort(df):
+    """
+    Score a pandas DataFrame (one row per patient, columns named like the
+    calculate_indices inputs) in one vectorized pass.
+
+    Returns a DataFrame on df's index with the total score, risk category,
+    domain scores and every key index with its severity, ready to join back
+    onto df or export.
+    """
+    import pandas as pd
+
+    cohort = calculate_indices_batch({col: df[col].to_numpy() for col in df.columns})
+    table = pd.DataFrame(
+        {
+            "Total Score (0-100)": np.round(cohort.total_score, 1),
+            "Risk Category": cohort.risk_cat,
+            **cohort.domain_scores,
+        },
+        index=df.index,
+    )
+    # Per-index values and severities, in the single-patient display order
+    for key in KEY_ORDER:
+        table[key] = cohort.indices[key]
+        table[f"{key} Severity"] = cohort.idx_sev[key]
+    return table
 
 
 # ----------------- PDF builder ----------------- #
 
+# Static report text, sanitised once at import
+_PDF_TITLE = to_latin1("DiaWell C.O.R.E. Foundation - Metabolic Health Report")
+_PDF_DISCLAIMER = to_latin1(
+    "This report is for educational and metabolic recovery guidance only and does not "
+    "replace clinical judgment or diagnostic workup. Please correlate with full clinical context."
+)
+
+# Abbreviation legend as one multi_cell block, joined and sanitised once at import (ASCII ONLY)
+_PDF_LEGEND = to_latin1(
+    "\n".join(
+        (
+            "NLR = Neutrophil-to-Lymphocyte Ratio",
+            "PLR = Platelet-to-Lymphocyte Ratio",
+            "SII = (Platelets x ANC) / ALC (all in x10^9/L)",
+            "SIRI = (ANC x AMC) / ALC",
+            "AIP = log10[TG(mmol/L)/HDL-C(mmol/L)]",
+            "TyG = Triglyceride-Glucose Index",
+            "METS-IR = Metabolic Score for Insulin Resistance",
+            "HSI = Hepatic Steatosis Index",
+            "FIB-4 = Fibrosis-4 Index",
+            "eGDR = Estimated Glucose Disposal Rate",
+            "RDW = Red Cell Distribution Width",
+            "RDW/Hb = RDW-to-Hemoglobin ratio",
+            "Hb/MCV = Hemoglobin-to-MCV ratio",
+            "RLR = RDW-to-Lymphocyte ratio",
+            "NHR = Neutrophil-to-HDL ratio",
+            "MHR = Monocyte-to-HDL ratio",
+            "RPR = RDW-to-Platelet ratio",
+            "Non-HDL = Total Cholesterol - HDL-C",
+            "PNI = 10 x Albumin(g/dL) + 5 x ALC(x10^9/L)",
+        )
+    )
+)
+
+
+def _pdf_section(pdf, title, body_size=11):
+    """Bold section heading, then switch straight back to the body font."""
+    pdf.set_font("Helvetica", "B", 12)
+    pdf.cell(0, 7, to_latin1(title), ln=True)
+    pdf.set_font("Helvetica", "", body_size)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
 def build_pdf(patient, indices, idx_sev, domain_scores, domain_labels, total_score, risk_cat):
     from fpdf import FPDF
 
     pdf = FPDF()
+    # Short, one-off report: skip zlib on the page streams (the download is compressed on the wire anyway)
+    pdf.set_compression(False)
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
 
@@ -503,123 +623,60 @@ def build_pdf(patient, indices, idx_sev, domain_scores, domain_labels, total_sco
 
     # Header
     pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(0, 10, to_latin1("DiaWell C.O.R.E. Foundation - Metabolic Health Report"), ln=True)
+    pdf.cell(0, 10, _PDF_TITLE, ln=True)
 
     pdf.ln(3)
     pdf.set_font("Helvetica", "", 11)
 
-    line1 = f"Patient Name: {patient.get('name', '')}"
-    line2 = f"Age/Sex: {patient.get('age', '')} / {patient.get('sex', '')}"
-    line3 = f"Date: {patient.get('date', '')}"
-    line4 = f"Diabetes: {'Yes' if patient.get('diabetes', False) else 'No'}"
-
-    pdf.cell(0, 6, to_latin1(line1), ln=True)
-    pdf.cell(0, 6, to_latin1(line2), ln=True)
-    pdf.cell(0, 6, to_latin1(line3), ln=True)
-    pdf.cell(0, 6, to_latin1(line4), ln=True)
+    header = (
+        f"Patient Name: {patient.get('name', '')}\n"
+        f"Age/Sex: {patient.get('age', '')} / {patient.get('sex', '')}\n"
+        f"Date: {patient.get('date', '')}\n"
+        f"Diabetes: {'Yes' if patient.get('diabetes', False) else 'No'}"
+    )
+    pdf.set_x(pdf.l_margin)
+    pdf.multi_cell(effective_width, 6, to_latin1(header))
 
     pdf.ln(5)
 
     # Overall summary
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 7, to_latin1("Overall Summary"), ln=True)
-    pdf.set_font("Helvetica", "", 11)
+    _pdf_section(pdf, "Overall Summary")
 
     score_str = f"{round(total_score, 1)}" if total_score is not None else "NA"
-    pdf.cell(0, 6, to_latin1(f"Total Score (0-100): {score_str}"), ln=True)
-    pdf.cell(0, 6, to_latin1(f"Risk Category: {risk_cat}"), ln=True)
+    pdf.set_x(pdf.l_margin)
+    pdf.multi_cell(effective_width, 6, to_latin1(f"Total Score (0-100): {score_str}\nRisk Category: {risk_cat}"))
 
     # Domain scores
     pdf.ln(4)
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 7, to_latin1("Domain Scores (0-25 each)"), ln=True)
-    pdf.set_font("Helvetica", "", 11)
+    _pdf_section(pdf, "Domain Scores (0-25 each)")
 
-    for dom in ["Inflammation", "Oxidative / Hb-MCV", "Endothelial", "Metabolic / Liver / IR"]:
-        sc = domain_scores.get(dom, 0.0)
-        lab = domain_labels.get(dom, "NA")
-        pdf.cell(0, 6, to_latin1(f"{dom}: {round(sc, 1)} ({lab})"), ln=True)
+    domain_lines = [f"{dom}: {score} ({lab})" for dom, score, lab in domain_rows(domain_scores, domain_labels)]
+    pdf.set_x(pdf.l_margin)
+    pdf.multi_cell(effective_width, 6, to_latin1("\n".join(domain_lines)))
 
     # Key indices
     pdf.ln(4)
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 7, to_latin1("Key Indices (with severity)"), ln=True)
-    pdf.set_font("Helvetica", "", 11)
+    _pdf_section(pdf, "Key Indices (with severity)")
 
-    key_order = [
-        "NLR", "PLR", "SII", "SIRI",
-        "TyG", "METS-IR", "AIP",
-        "HSI", "FIB-4", "eGDR",
-        "RDW", "RDW/Hb", "Hb/MCV",
-        "RLR", "NHR", "MHR",
-        "RPR", "Non-HDL", "PNI",
-    ]
-    for key in key_order:
-        if key not in indices:
-            continue
-        val = indices.get(key)
-        lab = idx_sev.get(key, "NA")
-        if val is None:
-            val_str = "NA"
-        else:
-            if isinstance(val, (int, float)) and abs(val) >= 100:
-                val_str = f"{val:.1f}"
-            elif isinstance(val, (int, float)):
-                val_str = f"{val:.2f}"
-            else:
-                val_str = str(val)
-        line = f"{key}: {val_str} ({lab})"
-        pdf.cell(0, 6, to_latin1(line), ln=True)
+    index_lines = [f"{key}: {val_str} ({lab})" for key, val_str, lab in index_rows(indices, idx_sev)]
+    pdf.set_x(pdf.l_margin)
+    pdf.multi_cell(effective_width, 6, to_latin1("\n".join(index_lines)))
 
     # Legend (ASCII ONLY)
     pdf.ln(4)
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.cell(0, 7, to_latin1("Abbreviation Legend"), ln=True)
-    pdf.set_font("Helvetica", "", 10)
-
-    legend_lines = [
-        "NLR = Neutrophil-to-Lymphocyte Ratio",
-        "PLR = Platelet-to-Lymphocyte Ratio",
-        "SII = (Platelets x ANC) / ALC (all in x10^9/L)",
-        "SIRI = (ANC x AMC) / ALC",
-        "AIP = log10[TG(mmol/L)/HDL-C(mmol/L)]",
-        "TyG = Triglyceride-Glucose Index",
-        "METS-IR = Metabolic Score for Insulin Resistance",
-        "HSI = Hepatic Steatosis Index",
-        "FIB-4 = Fibrosis-4 Index",
-        "eGDR = Estimated Glucose Disposal Rate",
-        "RDW = Red Cell Distribution Width",
-        "RDW/Hb = RDW-to-Hemoglobin ratio",
-        "Hb/MCV = Hemoglobin-to-MCV ratio",
-        "RLR = RDW-to-Lymphocyte ratio",
-        "NHR = Neutrophil-to-HDL ratio",
-        "MHR = Monocyte-to-HDL ratio",
-        "RPR = RDW-to-Platelet ratio",
-        "Non-HDL = Total Cholesterol - HDL-C",
-        "PNI = 10 x Albumin(g/dL) + 5 x ALC(x10^9/L)",
-    ]
-
-    for ln in legend_lines:
-        pdf.set_x(pdf.l_margin)
-        pdf.multi_cell(effective_width, 5, to_latin1(ln))
+    _pdf_section(pdf, "Abbreviation Legend", body_size=10)
+
+    pdf.set_x(pdf.l_margin)
+    pdf.multi_cell(effective_width, 5, _PDF_LEGEND)
 
     # Disclaimer
     pdf.ln(3)
     pdf.set_font("Helvetica", "", 9)
-    disclaimer = (
-        "This report is for educational and metabolic recovery guidance only and does not "
-        "replace clinical judgment or diagnostic workup. Please correlate with full clinical context."
-    )
     pdf.set_x(pdf.l_margin)
-    pdf.multi_cell(effective_width, 5, to_latin1(disclaimer))
-
-    result = pdf.output(dest="S")
-    if isinstance(result, str):
-        pdf_bytes = result.encode("latin-1", "ignore")
-    else:
-        pdf_bytes = bytes(result)
+    pdf.multi_cell(effective_width, 5, _PDF_DISCLAIMER)
 
-    return pdf_bytes
+    # fpdf2 returns the document as a bytearray; st.download_button wants bytes
+    return bytes(pdf.output())
 
 
 # ----------------- Streamlit UI ----------------- #
@@ -720,7 +777,7 @@ def main():
             "htn": htn,
         }
 
-        indices, idx_sev, domain_scores, domain_labels, total_score, risk_cat = calculate_indices(inputs)
+        report = calculate_indices(inputs)
 
         st.success("Report calculated successfully.")
 
@@ -728,37 +785,25 @@ def main():
 
         with colA:
             st.subheader("Overall Summary")
-            st.metric("Total Score (0-100)", f"{total_score:.1f}")
-            st.write(f"**Risk Category:** {risk_cat}")
+            st.metric("Total Score (0-100)", f"{report.total_score:.1f}")
+            st.write(f"**Risk Category:** {report.risk_cat}")
 
             st.subheader("Domain Scores (0-25)")
-            for dom in ["Inflammation", "Oxidative / Hb-MCV", "Endothelial", "Metabolic / Liver / IR"]:
-                sc = domain_scores.get(dom, 0.0)
-                lab = domain_labels.get(dom, "NA")
-                st.write(f"- **{dom}**: {sc:.1f} ({lab})")
+            st.markdown(
+                "\n".join(
+                    f"- **{dom}**: {score} ({lab})"
+                    for dom, score, lab in domain_rows(report.domain_scores, report.domain_labels)
+                )
+            )
 
         with colB:
             st.subheader("Key Indices")
-            for key in [
-                "NLR", "PLR", "SII", "SIRI",
-                "TyG", "METS-IR", "AIP",
-                "HSI", "FIB-4", "eGDR",
-                "RDW", "RDW/Hb", "Hb/MCV",
-                "RLR", "NHR", "MHR",
-                "RPR", "Non-HDL", "PNI",
-            ]:
-                val = indices.get(key)
-                lab = idx_sev.get(key, "NA")
-                if val is None:
-                    disp = "NA"
-                else:
-                    if isinstance(val, (int, float)) and abs(val) >= 100:
-                        disp = f"{val:.1f}"
-                    elif isinstance(val, (int, float)):
-                        disp = f"{val:.2f}"
-                    else:
-                        disp = str(val)
-                st.write(f"- **{key}**: {disp}  ({lab})")
+            st.markdown(
+                "\n".join(
+                    f"- **{key}**: {val_str}  ({lab})"
+                    for key, val_str, lab in index_rows(report.indices, report.idx_sev)
+                )
+            )
 
         patient = {
             "name": name,
@@ -768,19 +813,10 @@ def main():
             "diabetes": diabetes_flag,
         }
 
-        pdf_bytes = build_pdf(
-            patient=patient,
-            indices=indices,
-            idx_sev=idx_sev,
-            domain_scores=domain_scores,
-            domain_labels=domain_labels,
-            total_score=total_score,
-            risk_cat=risk_cat,
-        )
-
+        # The PDF is only built when the download button is clicked.
         st.download_button(
             label="Download PDF Report",
-            data=pdf_bytes,
+            data=partial(build_pdf, patient=patient, **report._asdict()),
             file_name=f"DiaWell_Metabolic_Report_{name or 'patient'}.pdf",
             mime="application/pdf",
         )
@@ -789,6 +825,34 @@ def main():
             "This tool is for educational and metabolic recovery guidance only and does not replace clinical judgment."
         )
 
+    # ---- Cohort mode: score a whole CSV in one vectorized pass ---- #
+    st.markdown("---")
+    st.subheader("Cohort Mode")
+    cohort_file = st.file_uploader(
+        "Cohort CSV (optional) - one row per patient, columns named like the form inputs "
+        "(age, sex, diabetes, wbc, neut_pct, ..., htn); leave missing values blank",
+        type="csv",
+    )
+    if cohort_file is not None:
+        import pandas as pd
+
+        try:
+            df = pd.read_csv(cohort_file)
+            table = score_cohort(df)
+        except ValueError as exc:
+            st.error(f"Could not score the cohort CSV: {exc}")
+        else:
+            if "name" in df.columns:
+                table.insert(0, "Name", df["name"])
+            st.write(f"Scored {len(table)} patients.")
+            st.dataframe(table, hide_index=True)
+            st.download_button(
+                label="Download Cohort CSV",
+                data=table.to_csv(index=False).encode("utf-8"),
+                file_name="DiaWell_Cohort_Scores.csv",
+                mime="text/csv",
+            )
+
 
 if __name__ == "__main__":
     main()